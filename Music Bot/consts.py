@@ -6,4 +6,18 @@ LAVALINK_PASSWORD = "LAVALINK PASSWORD"
 OWNER_ID = 80967066455678509
 SPOTIFY_CLIENT_ID = "CLIENT ID"
 SPOTIFY_CLIENT_SECRET = "CLIENT SECRET"
-GENIUS_ACCESS_TOKEN = "ACCESS TOKEN"
\ No newline at end of file
+GENIUS_ACCESS_TOKEN = "ACCESS TOKEN"
+# Leave LOCAL_LIBRARY_PATH empty to disable the local library.
+# Lavalink must have local sources enabled and be able to read this directory.
+LOCAL_LIBRARY_PATH = ""
+LOCAL_LIBRARY_DB = "library.db"
+LOCAL_LIBRARY_SCAN_INTERVAL = 60
+# Order in which `play` tries sources for queries without a `local:` prefix.
+SOURCE_ORDER = ["local", "remote"]
+
+# Fraction of commands to trace (0 disables tracing, 1 traces everything).
+# Summarize the file with `python tracing.py`.
+TRACE_SAMPLE_RATE = 0.0
+TRACE_FILE = "traces.jsonl"
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUP_COUNT = 3
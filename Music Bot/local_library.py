@@ -0,0 +1,158 @@
+import asyncio
+import contextlib
+import logging
+import os
+import re
+import sqlite3
+from typing import Iterator, List
+
+import mutagen
+
+AUDIO_EXTENSIONS = (".mp3", ".flac", ".ogg", ".opus", ".m4a", ".wav", ".aac", ".webm")
+
+# Bump when the schema changes, older databases are rebuilt from scratch.
+SCHEMA_VERSION = 1
+
+# tracks_fts rows share their rowid with the tracks row of the same file,
+# so they can be deleted by rowid instead of scanning the unindexed path.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    path UNINDEXED, title, artist, album
+);
+"""
+
+class LocalLibrary:
+    """SQLite full-text index of the audio files in a local directory."""
+
+    def __init__(self, root: str, db_path: str) -> None:
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+
+        with self._connect() as db:
+            # WAL lets searches read while a scan is writing, instead of waiting on its lock.
+            db.execute("PRAGMA journal_mode=WAL")
+            if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                db.executescript("DROP TABLE IF EXISTS tracks; DROP TABLE IF EXISTS tracks_fts;")
+            db.executescript(SCHEMA)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A fresh connection per call, so scans and searches can run in
+        # different executor threads.
+        db = sqlite3.connect(self.db_path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_tags(path: str) -> tuple:
+        title = artist = album = ""
+
+        # Corrupt files can make mutagen raise more than MutagenError, one bad
+        # file shouldn't roll back the whole scan.
+        try:
+            tags = mutagen.File(path, easy = True)
+        except Exception as error:
+            logging.warning("Local library: could not read tags of %s: %r", path, error)
+            tags = None
+
+        if tags and tags.tags:
+            title = " ".join(tags.tags.get("title", []))
+            artist = " ".join(tags.tags.get("artist", []))
+            album = " ".join(tags.tags.get("album", []))
+
+        # Untagged files are still searchable by their file name.
+        if not title:
+            title = os.path.splitext(os.path.basename(path))[0]
+
+        return title, artist, album
+
+    def scan(self) -> int:
+        """Indexes new and modified files, and drops deleted ones. Returns the number of changes."""
+
+        on_disk = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    path = os.path.join(directory, name)
+                    try:
+                        on_disk[path] = os.path.getmtime(path)
+                    except OSError:
+                        continue
+
+        with self._connect() as db:
+            indexed = {path: (id, mtime) for id, path, mtime in db.execute("SELECT id, path, mtime FROM tracks")}
+
+        removed = [indexed[path][0] for path in indexed.keys() - on_disk.keys()]
+
+        # Read the tags before opening the write transaction, so it stays short.
+        changed = []
+        for path, mtime in on_disk.items():
+            if path in indexed and indexed[path][1] == mtime:
+                continue
+            changed.append((path, mtime, self._read_tags(path)))
+
+        if not removed and not changed:
+            return 0
+
+        with self._connect() as db:
+            for id in removed:
+                db.execute("DELETE FROM tracks WHERE id = ?", (id,))
+                db.execute("DELETE FROM tracks_fts WHERE rowid = ?", (id,))
+
+            for path, mtime, (title, artist, album) in changed:
+                if path in indexed:
+                    id = indexed[path][0]
+                    db.execute("UPDATE tracks SET mtime = ? WHERE id = ?", (mtime, id))
+                    db.execute("DELETE FROM tracks_fts WHERE rowid = ?", (id,))
+                else:
+                    id = db.execute("INSERT INTO tracks (path, mtime) VALUES (?, ?)", (path, mtime)).lastrowid
+
+                db.execute(
+                    "INSERT INTO tracks_fts (rowid, path, title, artist, album) VALUES (?, ?, ?, ?, ?)",
+                    (id, path, title, artist, album)
+                )
+
+        return len(removed) + len(changed)
+
+    def search(self, query: str, limit: int = 1) -> List[str]:
+        """Returns the paths of the best matching files for the query."""
+
+        # Quote every word so user input can't be parsed as FTS5 syntax,
+        # and prefix match it so partial words still hit.
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+
+        match = " ".join(f'"{word}"*' for word in words)
+
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT path FROM tracks_fts WHERE tracks_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit)
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+    async def watch(self, interval: float) -> None:
+        """Rescans the library every `interval` seconds, picking up added, changed and removed files."""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                changes = await loop.run_in_executor(None, self.scan)
+                if changes:
+                    logging.info("Local library: indexed %d changes in %s", changes, self.root)
+            except Exception:
+                logging.exception("Local library scan failed")
+
+            await asyncio.sleep(interval)
@@ -1,15 +1,22 @@
+import asyncio
 import logging
-from typing import Optional
+import random
+from collections import deque
+from typing import Dict, List, Optional, Set
 
 import hikari
 import lightbulb
 import lavasnek_rs
 import spotipy
+import tracing
 import re
+import sqlite3
 import lyricsgenius
 import urllib.parse as urlparse
 from spotipy.oauth2 import SpotifyClientCredentials
 from consts import LAVALINK_PASSWORD, PREFIX, TOKEN, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, GENIUS_ACCESS_TOKEN
+from consts import LOCAL_LIBRARY_PATH, LOCAL_LIBRARY_DB, LOCAL_LIBRARY_SCAN_INTERVAL, SOURCE_ORDER
+from local_library import LocalLibrary
 from lightbulb.utils import pag, nav
 from lightbulb.ext import neon
 
@@ -18,18 +25,92 @@ HIKARI_VOICE = False
 
 URL_REGEX = r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))"
 TIME_REGEX = r"([0-9]{1,2})[:ms](([0-9]{1,2})s?)?"
+LOCAL_PREFIX = "local:"
+# Valid entries for SOURCE_ORDER.
+SOURCES = ("local", "remote")
+
+# How many related tracks autoplay keeps prefetched per guild.
+AUTOPLAY_BUFFER = 3
+# How many of the last played tracks autoplay won't pick again.
+AUTOPLAY_RECENT = 20
+# How many played tracks are remembered per guild, older ones can be picked as fallback candidates.
+AUTOPLAY_HISTORY = 50
 
 #TextChannel : dict
 
+class AutoplayCache:
+    """Per guild autoplay state: which guilds have it enabled, their play history and prefetched tracks."""
+
+    def __init__(self) -> None:
+        self.enabled: Set[int] = set()
+        self.history: Dict[int, deque] = {}
+        self.candidates: Dict[int, List[lavasnek_rs.Track]] = {}
+        self.prefetching: Dict[int, asyncio.Task] = {}
+
+    def record(self, guild_id: int, track: lavasnek_rs.Track) -> None:
+        self.history.setdefault(guild_id, deque(maxlen = AUTOPLAY_HISTORY)).append(track)
+
+    def is_recent(self, guild_id: int, track: lavasnek_rs.Track) -> bool:
+        recent = list(self.history.get(guild_id, []))[-AUTOPLAY_RECENT:]
+        return any(t.info.identifier == track.info.identifier for t in recent)
+
+    def add_candidate(self, guild_id: int, track: lavasnek_rs.Track) -> bool:
+        candidates = self.candidates.setdefault(guild_id, [])
+        if len(candidates) >= AUTOPLAY_BUFFER or self.is_recent(guild_id, track):
+            return False
+        if any(t.info.identifier == track.info.identifier for t in candidates):
+            return False
+
+        candidates.append(track)
+        return True
+
+    def pop_next(self, guild_id: int) -> Optional[lavasnek_rs.Track]:
+        candidates = self.candidates.get(guild_id, [])
+        while candidates:
+            track = candidates.pop(0)
+            # Something may have been played since this was prefetched.
+            if not self.is_recent(guild_id, track):
+                return track
+        return None
+
+    def start_prefetch(self, guild_id: int, track: lavasnek_rs.Track) -> None:
+        if guild_id not in self.prefetching:
+            self.prefetching[guild_id] = asyncio.create_task(_autoplay_prefetch(guild_id, track))
+
+    def reset(self, guild_id: int) -> None:
+        """Drops the prefetched tracks, and stops any prefetch still filling them."""
+
+        self.candidates.pop(guild_id, None)
+        task = self.prefetching.pop(guild_id, None)
+        if task:
+            task.cancel()
+
+    def clear(self, guild_id: int) -> None:
+        self.history.pop(guild_id, None)
+        self.reset(guild_id)
+
 class EventHandler:
     """Events from the Lavalink server"""
 
     async def track_start(self, lavalink: lavasnek_rs.Lavalink, event: lavasnek_rs.TrackStart) -> None:
         logging.info("Track started on guild: %s", event.guild_id)
+        tracing.first_audio(event.guild_id)
 
         # If your bot is going to be in multiple servers, I recommend removing the following code.
         # Since my bot is going to be used in just one server, I am setting the currently playing song as the Activity.
         node = await lavalink.get_guild_node(event.guild_id)
+        cache = plugin.bot.d.autoplay
+
+        cache.record(event.guild_id, node.now_playing.track)
+
+        if event.guild_id in cache.enabled:
+            # A track someone asked for changes what's "related", so drop the old picks.
+            if node.now_playing.requester != plugin.bot.get_me().id:
+                cache.reset(event.guild_id)
+
+            # Find what to play next while the last song is still playing.
+            if len(node.queue) <= 1:
+                cache.start_prefetch(event.guild_id, node.now_playing.track)
 
         await plugin.bot.update_presence(
             activity = hikari.Activity(
@@ -43,6 +124,10 @@ class EventHandler:
 
         node = await lavalink.get_guild_node(event.guild_id)
 
+        # Only continue on tracks that ended by themselves, not when stopped or replaced.
+        if not node.queue and event.reason == "FINISHED" and await _autoplay_next(event.guild_id):
+            return
+
         if not node.queue:
             await plugin.bot.update_presence(
                 activity = hikari.Activity(
@@ -96,8 +181,8 @@ class NowPlayingButtons(neon.ComponentMenu):
             )
         else:
             # If the queue is empty, the next track won't start playing (because there isn't any),
-            # so we stop the player.
-            if not node.queue and not node.now_playing:
+            # so we stop the player, unless autoplay has something to continue with.
+            if not node.queue and not node.now_playing and not await _autoplay_next(self.context.guild_id):
                 await plugin.bot.d.lavalink.stop(self.context.guild_id)
                 await self.edit_msg(
                     embed = hikari.Embed(
@@ -135,35 +220,59 @@ async def _join(ctx: lightbulb.Context) -> Optional[hikari.Snowflake]:
     bot_voice_state = [state async for state in states.iterator().filter(lambda i: i.user_id == ctx.bot.get_me().id)]
 
     if not voice_state:
-        await ctx.respond("Connect to a voice channel first.")
+        await _respond(ctx, "Connect to a voice channel first.")
         return None
 
     channel_id = voice_state[0].channel_id
 
     if bot_voice_state:
         if channel_id != bot_voice_state[0].channel_id:
-            await ctx.respond("I am already playing in another Voice Channel.")
+            await _respond(ctx, "I am already playing in another Voice Channel.")
             return None
 
     if HIKARI_VOICE:
         assert ctx.guild_id is not None
 
-        await plugin.bot.update_voice_state(ctx.guild_id, channel_id, self_deaf=True)
-        connection_info = await plugin.bot.d.lavalink.wait_for_full_connection_info_insert(ctx.guild_id)
+        with tracing.span("join.update_voice_state"):
+            await plugin.bot.update_voice_state(ctx.guild_id, channel_id, self_deaf=True)
+        with tracing.span("join.wait_for_full_connection_info_insert"):
+            connection_info = await plugin.bot.d.lavalink.wait_for_full_connection_info_insert(ctx.guild_id)
 
     else:
         try:
-            connection_info = await plugin.bot.d.lavalink.join(ctx.guild_id, channel_id)
+            with tracing.span("join.voice_handshake"):
+                connection_info = await plugin.bot.d.lavalink.join(ctx.guild_id, channel_id)
         except TimeoutError:
-            await ctx.respond(
+            await _respond(
+                ctx,
                 "I was unable to connect to the voice channel, maybe missing permissions? or some internal issue."
             )
             return None
 
-    await plugin.bot.d.lavalink.create_session(connection_info)
+    with tracing.span("join.create_session"):
+        await plugin.bot.d.lavalink.create_session(connection_info)
 
     return channel_id
 
+async def _respond(ctx: lightbulb.Context, *args, **kwargs) -> lightbulb.ResponseProxy:
+    """`ctx.respond`, timed as a span of the command's trace."""
+
+    with tracing.span("respond"):
+        return await ctx.respond(*args, **kwargs)
+
+def _track_link(info: lavasnek_rs.Info, text: Optional[str] = None) -> str:
+    """Markdown link to the track, local files have a path instead of a URL so they only get the text."""
+
+    text = text or info.title
+    if not info.uri.startswith(("http://", "https://")):
+        return text
+    return f"[{text}]({info.uri})"
+
+def _track_thumbnail(info: lavasnek_rs.Info) -> Optional[str]:
+    if "youtube.com/" not in info.uri and "youtu.be/" not in info.uri:
+        return None
+    return f"https://img.youtube.com/vi/{info.identifier}/maxresdefault.jpg"
+
 async def requester_check(ctx: lightbulb.Context) -> bool:
     states = plugin.bot.cache.get_voice_states_view_for_guild(ctx.guild_id)
     voice_state = [state async for state in states.iterator().filter(lambda i: i.user_id == ctx.author.id)]
@@ -199,10 +308,137 @@ async def start_lavalink(event: hikari.ShardReadyEvent) -> None:
     lava_client = await builder.build(EventHandler())
 
     plugin.bot.d.lavalink = lava_client
+    plugin.bot.d.autoplay = AutoplayCache()
 
     plugin.bot.unsubscribe(hikari.ShardReadyEvent, start_lavalink)
 
 
+@plugin.listener(hikari.StartedEvent)
+async def start_local_library(event: hikari.StartedEvent) -> None:
+    """Opens the local library index and keeps it up to date in the background."""
+
+    plugin.bot.d.library = None
+
+    if not LOCAL_LIBRARY_PATH:
+        return
+
+    plugin.bot.d.library = LocalLibrary(LOCAL_LIBRARY_PATH, LOCAL_LIBRARY_DB)
+    plugin.bot.d.library_watcher = asyncio.create_task(plugin.bot.d.library.watch(LOCAL_LIBRARY_SCAN_INTERVAL))
+
+
+@plugin.listener(hikari.StoppingEvent)
+async def stop_local_library(event: hikari.StoppingEvent) -> None:
+    if plugin.bot.d.get("library_watcher"):
+        plugin.bot.d.library_watcher.cancel()
+
+
+async def _autoplay_prefetch(guild_id: int, track: lavasnek_rs.Track) -> None:
+    """Fills the guild's autoplay buffer with tracks by the same artist, falling back to older plays."""
+
+    cache = plugin.bot.d.autoplay
+
+    try:
+        query_information = await plugin.bot.d.lavalink.get_tracks(f"ytmsearch:{track.info.author}")
+        for related in query_information.tracks:
+            if related.info.identifier != track.info.identifier:
+                cache.add_candidate(guild_id, related)
+
+        older = list(cache.history.get(guild_id, []))
+        random.shuffle(older)
+        for played in older:
+            if len(cache.candidates.get(guild_id, [])) >= AUTOPLAY_BUFFER:
+                break
+            cache.add_candidate(guild_id, played)
+    except Exception:
+        logging.exception("Autoplay prefetch failed on guild: %s", guild_id)
+    finally:
+        # When called inline by `_autoplay_next` this isn't the registered task,
+        # so leave whichever one is registered alone.
+        if cache.prefetching.get(guild_id) is asyncio.current_task():
+            cache.prefetching.pop(guild_id)
+
+
+async def _autoplay_next(guild_id: int) -> bool:
+    """Queues the next prefetched track if autoplay is enabled, returns whether it did."""
+
+    cache = plugin.bot.d.autoplay
+
+    if guild_id not in cache.enabled:
+        return False
+
+    track = cache.pop_next(guild_id)
+    if not track:
+        # The buffer is empty (or all of it was played meanwhile), wait for the
+        # prefetch that's still running, or search now instead.
+        history = cache.history.get(guild_id)
+        if guild_id in cache.prefetching:
+            task = cache.prefetching[guild_id]
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # The prefetch was cancelled (leave, autoplay disabled...), not us.
+                if not task.cancelled():
+                    raise
+                return False
+        elif history:
+            await _autoplay_prefetch(guild_id, history[-1])
+        track = cache.pop_next(guild_id)
+        if not track:
+            return False
+
+    await plugin.bot.d.lavalink.play(guild_id, track).requester(plugin.bot.get_me().id).queue()
+    return True
+
+
+async def _search_local(query: str) -> Optional[lavasnek_rs.Tracks]:
+    """Looks the query up in the local library index and loads the best match as a local-file track."""
+
+    if not plugin.bot.d.get("library"):
+        return None
+
+    # Searching is a blocking SQLite call, keep it off the event loop.
+    try:
+        with tracing.span("search.local_index"):
+            paths = await asyncio.get_running_loop().run_in_executor(None, plugin.bot.d.library.search, query)
+    except sqlite3.Error:
+        logging.exception("Local library search failed")
+        return None
+
+    if not paths:
+        return None
+
+    with tracing.span("search.lavalink_local"):
+        return await plugin.bot.d.lavalink.get_tracks(paths[0])
+
+
+async def _search_tracks(query: str) -> Optional[lavasnek_rs.Tracks]:
+    """Searches the query on the sources in SOURCE_ORDER, returning the first one with results.
+
+    Queries starting with `local:` are only searched in the local library.
+    """
+
+    if query[:len(LOCAL_PREFIX)].lower() == LOCAL_PREFIX:
+        return await _search_local(query[len(LOCAL_PREFIX):].strip())
+
+    query_information = None
+    for source in SOURCE_ORDER:
+        if source == "local":
+            # URLs always go to Lavalink, the library can only answer searches.
+            if re.match(URL_REGEX, query):
+                continue
+            query_information = await _search_local(query)
+        elif source == "remote":
+            # auto_search will get the track from a url if possible, otherwise,
+            # it will search the query on youtube.
+            with tracing.span("search.lavalink"):
+                query_information = await plugin.bot.d.lavalink.auto_search_tracks(query)
+
+        if query_information and query_information.tracks:
+            break
+
+    return query_information
+
+
 @plugin.command()
 @lightbulb.add_checks(lightbulb.guild_only)
 @lightbulb.command("join", "Joins the voice channel you are in.")
@@ -234,6 +470,7 @@ async def leave(ctx: lightbulb.Context) -> None:
     # Destroy nor leave remove the node nor the queue loop, you should do this manually.
     await plugin.bot.d.lavalink.remove_guild_node(ctx.guild_id)
     await plugin.bot.d.lavalink.remove_guild_from_loops(ctx.guild_id)
+    plugin.bot.d.autoplay.clear(ctx.guild_id)
 
     await ctx.respond("Left voice channel")
 
@@ -241,15 +478,16 @@ async def leave(ctx: lightbulb.Context) -> None:
 @plugin.command()
 @lightbulb.add_checks(lightbulb.guild_only)
 @lightbulb.option("query", "The query to search for.", modifier=lightbulb.OptionModifier.CONSUME_REST)
-@lightbulb.command("play", "Searches the query on youtube, or adds the URL to the queue.", auto_defer = True)
+@lightbulb.command("play", "Searches the query on youtube or the local library (local:), or adds the URL to the queue.", auto_defer = True)
 @lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
+@tracing.traced
 async def play(ctx: lightbulb.Context) -> None:
-    """Searches the query on youtube, or adds the URL to the queue."""
+    """Searches the query on youtube or the local library (local:), or adds the URL to the queue."""
 
     query = ctx.options.query
 
     if not query:
-        await ctx.respond("Please specify a query.")
+        await _respond(ctx, "Please specify a query.")
         return None
 
     con = plugin.bot.d.lavalink.get_guild_gateway_connection_info(ctx.guild_id)
@@ -257,6 +495,12 @@ async def play(ctx: lightbulb.Context) -> None:
     #if not con:
     await _join(ctx)
 
+    # Time to the first audio only makes sense if this command's track is the one that starts playing,
+    # so it's only awaited for the first track queued onto an idle player. It's registered before
+    # queueing since the track can start before `.queue()` returns.
+    node = await plugin.bot.d.lavalink.get_guild_node(ctx.guild_id)
+    was_idle = not node or not node.now_playing
+
     playlist = False
     isAlbum = False
     isSpotifySong = False
@@ -268,22 +512,28 @@ async def play(ctx: lightbulb.Context) -> None:
             playlist = True
             playlist_link = query
             playlist_URI = playlist_link.split("/")[-1].split("?")[0]
-            track_uris = [x["track"]["uri"] for x in sp.playlist_tracks(playlist_URI)["items"]]
-            playlist_info = sp.playlist(playlist_URI, fields = "name")
-            await ctx.respond(
+            with tracing.span("spotify.metadata"):
+                playlist_tracks = sp.playlist_tracks(playlist_URI)["items"]
+                playlist_info = sp.playlist(playlist_URI, fields = "name")
+            track_uris = [x["track"]["uri"] for x in playlist_tracks]
+            await _respond(ctx,
                 embed = hikari.Embed(
                     description = f"[{playlist_info['name']}]({query}) ({len(track_uris)} tracks) added to queue [{ctx.author.mention}].",
                     colour = 0x76ffa1
                 )  
             )
-            for track in sp.playlist_tracks(playlist_URI)["items"]:
+            for track in playlist_tracks:
                 track_name = track["track"]["name"]
                 track_artist = track["track"]["artists"][0]["name"]
                 queryfinal = f"{track_name} " + " " + f"{track_artist}" 
                 result = f"ytmsearch:{queryfinal}"
-                query_information = await plugin.bot.d.lavalink.get_tracks(result)
+                with tracing.span("search.lavalink"):
+                    query_information = await plugin.bot.d.lavalink.get_tracks(result)
                 if not query_information.tracks:
                     continue
+                if was_idle:
+                    tracing.await_first_audio(ctx.guild_id)
+                    was_idle = False
                 await plugin.bot.d.lavalink.play(ctx.guild_id, query_information.tracks[0]).requester(ctx.author.id).queue()
                 i += 1
     
@@ -291,14 +541,20 @@ async def play(ctx: lightbulb.Context) -> None:
             isAlbum = True
             album_link = f"{query}"
             album_id= album_link.split("/")[-1].split("?")[0]
-            for track in sp.album_tracks(album_id)["items"]:
+            with tracing.span("spotify.metadata"):
+                album_tracks = sp.album_tracks(album_id)["items"]
+            for track in album_tracks:
                 track_name = track["name"]
                 track_artist = track["artists"][0]["name"]
                 queryfinal = f"{track_name} " + f"{track_artist}" 
                 result = f"ytmsearch:{queryfinal}"
-                query_information = await plugin.bot.d.lavalink.get_tracks(result)
+                with tracing.span("search.lavalink"):
+                    query_information = await plugin.bot.d.lavalink.get_tracks(result)
                 if not query_information.tracks:
                     continue
+                if was_idle:
+                    tracing.await_first_audio(ctx.guild_id)
+                    was_idle = False
                 await plugin.bot.d.lavalink.play(ctx.guild_id, query_information.tracks[0]).requester(ctx.author.id).queue()
                 i += 1
         
@@ -306,50 +562,59 @@ async def play(ctx: lightbulb.Context) -> None:
             isSpotifySong = True
             track_link = query
             track_id = track_link.split("/")[-1].split("?")[0]
-            track_info = sp.track(track_id)
+            with tracing.span("spotify.metadata"):
+                track_info = sp.track(track_id)
             track_name = track_info["name"]
             track_artist = track_info["artists"][0]["name"]
             queryfinal = f"{track_artist} {track_name}"
             result = f"ytmsearch:{queryfinal}"
-            query_information = await plugin.bot.d.lavalink.get_tracks(result)
+            with tracing.span("search.lavalink"):
+                query_information = await plugin.bot.d.lavalink.get_tracks(result)
+            if was_idle:
+                tracing.await_first_audio(ctx.guild_id)
+                was_idle = False
             await plugin.bot.d.lavalink.play(ctx.guild_id, query_information.tracks[0]).requester(ctx.author.id).queue()
 
         if isAlbum:
-            album_info = sp.album(album_id)
-            await ctx.respond(
+            with tracing.span("spotify.metadata"):
+                album_info = sp.album(album_id)
+            await _respond(ctx,
                 embed = hikari.Embed(
                     description = f"[{album_info['name']}]({query}) ({i} tracks) has been added to queue [{ctx.author.mention}].",
                     colour = 0x76ffa1
                 )  
             )
         elif isSpotifySong:
-            await ctx.respond(
+            await _respond(ctx,
                 embed = hikari.Embed(
                     description = f"[{track_name}]({query}) added to queue [{ctx.author.mention}]",
                     colour = 0x76ffa1
                 )  
             )
 
-    # Search the query, auto_search will get the track from a url if possible, otherwise,
-    # it will search the query on youtube.
+    # Search the query on the local library and/or youtube, see `_search_tracks`.
     else:
-        query_information = await plugin.bot.d.lavalink.auto_search_tracks(query)
+        query_information = await _search_tracks(query)
+
+        if not query_information or not query_information.tracks:  # tracks is empty
+            await _respond(ctx, "Could not find any video of the search query.")
+            return
 
         if query_information.playlist_info.name:
             playlist = True
 
-        if not query_information.tracks:  # tracks is empty
-            await ctx.respond("Could not find any video of the search query.")
-            return
-
         if playlist:
             try:
                 for track in query_information.tracks:
+                    if was_idle:
+                        tracing.await_first_audio(ctx.guild_id)
+                        was_idle = False
                     await plugin.bot.d.lavalink.play(ctx.guild_id, track).requester(ctx.author.id).queue()
             except lavasnek_rs.NoSessionPresent:
-                await ctx.respond(f"Use `{PREFIX}join` first")
+                tracing.cancel_first_audio(ctx.guild_id)
+                await _respond(ctx, f"Use `{PREFIX}join` first")
         
-            await ctx.respond(
+            await _respond(ctx,
                 embed = hikari.Embed(
                     description = f"{query_information.playlist_info.name} ({len(query_information.tracks)} tracks) added to queue [{ctx.author.mention}]",
                     colour = 0x76ffa1
@@ -357,16 +622,20 @@ async def play(ctx: lightbulb.Context) -> None:
         )
         else:
             try:
+                if was_idle:
+                    tracing.await_first_audio(ctx.guild_id)
+                    was_idle = False
                 # `.requester()` To set who requested the track, so you can show it on now-playing or queue.
                 # `.queue()` To add the track to the queue rather than starting to play the track now.
                 await plugin.bot.d.lavalink.play(ctx.guild_id, query_information.tracks[0]).requester(ctx.author.id).queue()
             except lavasnek_rs.NoSessionPresent:
-                await ctx.respond(f"Use `{PREFIX}join` first")
+                tracing.cancel_first_audio(ctx.guild_id)
+                await _respond(ctx, f"Use `{PREFIX}join` first")
                 return
 
-            await ctx.respond(
+            await _respond(ctx,
                 embed = hikari.Embed(
-                    description = f"[{query_information.tracks[0].info.title}]({query_information.tracks[0].info.uri}) added to queue [{ctx.author.mention}]",
+                    description = f"{_track_link(query_information.tracks[0].info)} added to queue [{ctx.author.mention}]",
                     colour = 0x76ffa1
                 )
             )
@@ -409,14 +678,15 @@ async def skip(ctx: lightbulb.Context) -> None:
         await ctx.respond(":caution: Nothing to skip")
     else:
         # If the queue is empty, the next track won't start playing (because there isn't any),
-        # so we stop the player.
+        # so we stop the player, unless autoplay has something to continue with.
         if not node.queue and not node.now_playing:
-            await plugin.bot.d.lavalink.stop(ctx.guild_id)
+            if not await _autoplay_next(ctx.guild_id):
+                await plugin.bot.d.lavalink.stop(ctx.guild_id)
 
         await ctx.respond(
             
             embed = hikari.Embed(
-                description =   f":fast_forward: Skipped: [{skip.track.info.title}]({skip.track.info.uri})",
+                description =   f":fast_forward: Skipped: {_track_link(skip.track.info)}",
                 colour = 0xd25557
             )
         )
@@ -453,6 +723,40 @@ async def resume(ctx: lightbulb.Context) -> None:
         )
     )
 
+@plugin.command()
+@lightbulb.add_checks(lightbulb.guild_only, lightbulb.Check(requester_check, requester_check))
+@lightbulb.command("autoplay", "Toggles playing related songs when the queue runs out.")
+@lightbulb.implements(lightbulb.PrefixCommand, lightbulb.SlashCommand)
+async def autoplay(ctx: lightbulb.Context) -> None:
+    """Toggles playing related songs when the queue runs out."""
+
+    cache = plugin.bot.d.autoplay
+
+    if ctx.guild_id in cache.enabled:
+        cache.enabled.discard(ctx.guild_id)
+        cache.reset(ctx.guild_id)
+        await ctx.respond(
+            embed = hikari.Embed(
+                description = ":repeat: Autoplay disabled",
+                colour = 0xd25557
+            )
+        )
+        return
+
+    cache.enabled.add(ctx.guild_id)
+
+    # Start filling the buffer right away if the current song is the last one.
+    node = await plugin.bot.d.lavalink.get_guild_node(ctx.guild_id)
+    if node and node.now_playing and len(node.queue) <= 1:
+        cache.start_prefetch(ctx.guild_id, node.now_playing.track)
+
+    await ctx.respond(
+        embed = hikari.Embed(
+            description = ":repeat: Autoplay enabled, related songs will play when the queue runs out",
+            colour = 0x76ffa1
+        )
+    )
+
 @plugin.command()
 @lightbulb.add_checks(lightbulb.guild_only)
 @lightbulb.command("nowplaying", "Gets the song that's currently playing.", aliases=["np"])
@@ -479,7 +783,7 @@ async def now_playing(ctx: lightbulb.Context) -> None:
     resp = await ctx.respond(
         embed = hikari.Embed(
             title = "Now Playing",
-            description = f"[{node.now_playing.track.info.title}]({node.now_playing.track.info.uri})",
+            description = _track_link(node.now_playing.track.info),
             colour = 0x76ffa1
         ).add_field(
             name = "Artist:", value = f"{node.now_playing.track.info.author}", inline = True
@@ -488,11 +792,11 @@ async def now_playing(ctx: lightbulb.Context) -> None:
         ).add_field(
             name = "Requested by:", value = f"<@!{node.now_playing.requester}>", inline = True
         ).add_field(
-            name = "Up Next:", value = f"[{node.queue[1].track.info.title}]({node.queue[1].track.info.uri})" if len(node.queue) > 1 else f"Nothing else in queue"
+            name = "Up Next:", value = _track_link(node.queue[1].track.info) if len(node.queue) > 1 else f"Nothing else in queue"
         ).set_footer(
             text = f"Total Queue Length : {int(queue_amount[0])}:{round(queue_amount[1]/1000):02}"
         ).set_thumbnail(
-            f"https://img.youtube.com/vi/{node.now_playing.track.info.identifier}/maxresdefault.jpg"
+            _track_thumbnail(node.now_playing.track.info)
         ),
         #components = menu.build()
     )
@@ -514,12 +818,12 @@ async def queue(ctx : lightbulb.Context) -> None:
         return
     else:
         length = divmod(node.now_playing.track.info.length, 60000)
-        queueDescription = f"Now playing: [{node.now_playing.track.info.title}]({node.now_playing.track.info.uri}) `{int(length[0])}:{round(length[1]/1000):02}` [<@!{node.now_playing.requester}>] \n\nUp next:"
+        queueDescription = f"Now playing: {_track_link(node.now_playing.track.info)} `{int(length[0])}:{round(length[1]/1000):02}` [<@!{node.now_playing.requester}>] \n\nUp next:"
         # EmbPag.add_line(f"Now playing: [{node.now_playing.track.info.title}]({node.now_playing.track.info.uri}) `{l_minutes}:{l_seconds if first_n != 0 else f'0{l_seconds}'}` [<@!{node.now_playing.requester}>] \n\nUp next:")
         i = 1
         while True:
             length = divmod(node.queue[i].track.info.length, 60000)
-            queueDescription = queueDescription + f"\n[{i}. {node.queue[i].track.info.title}]({node.queue[i].track.info.uri}) `{int(length[0])}:{round(length[1]/1000):02}` [<@!{node.queue[i].requester}>]"
+            queueDescription = queueDescription + f"\n{_track_link(node.queue[i].track.info, f'{i}. {node.queue[i].track.info.title}')} `{int(length[0])}:{round(length[1]/1000):02}` [<@!{node.queue[i].requester}>]"
             i += 1
             if i >= len(node.queue) or i > 10:
                 break
@@ -561,7 +865,7 @@ async def seek(ctx: lightbulb.Context) -> None:
     await plugin.bot.d.lavalink.seek_millis(ctx.guild_id, secs * 1000)
     embed = hikari.Embed(title=f"Seeked {node.now_playing.track.info.title}.", colour=0xD7CBCC)
     try:
-        embed.set_thumbnail(f"https://img.youtube.com/vi/{node.now_playing.track.info.identifier}/maxresdefault.jpg")
+        embed.set_thumbnail(_track_thumbnail(node.now_playing.track.info))
     except:
         pass
     try:
@@ -631,6 +935,10 @@ if HIKARI_VOICE:
 
 
 def load(bot: lightbulb.BotApp) -> None:
+    unknown = [source for source in SOURCE_ORDER if source not in SOURCES]
+    if unknown:
+        logging.warning("Ignoring unknown SOURCE_ORDER entries %s, valid ones are %s", unknown, SOURCES)
+
     bot.add_plugin(plugin)
 
 
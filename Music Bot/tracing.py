@@ -0,0 +1,183 @@
+import argparse
+import contextlib
+import contextvars
+import functools
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterator, Optional
+
+import lightbulb
+from consts import TRACE_SAMPLE_RATE, TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default = None)
+
+_logger = logging.getLogger("tracing")
+_logger.propagate = False
+
+# Traces waiting for their track to start playing, by guild.
+_awaiting_audio: Dict[int, "Trace"] = {}
+# Seconds after which a trace stops waiting, a track starting later is unrelated to it.
+FIRST_AUDIO_TIMEOUT = 120
+
+
+def _setup_file() -> None:
+    if _logger.handlers or TRACE_SAMPLE_RATE <= 0:
+        return
+
+    handler = logging.handlers.RotatingFileHandler(TRACE_FILE, maxBytes = TRACE_MAX_BYTES, backupCount = TRACE_BACKUP_COUNT)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(handler)
+    _logger.setLevel(logging.INFO)
+
+
+class Trace:
+    """The spans of one sampled command invocation."""
+
+    def __init__(self, command: str, guild_id: Optional[int], received_at: float) -> None:
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.guild_id = guild_id
+        # Wall clock time the gateway event was created at, offsets are relative to it.
+        self.received_at = received_at
+
+    def write(self, name: str, start: float, duration: float) -> None:
+        _logger.info(json.dumps({
+            "trace_id": self.id,
+            "command": self.command,
+            "guild_id": self.guild_id,
+            "span": name,
+            "offset_ms": round((start - self.received_at) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+        }))
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the block as a span of the current command's trace, if it is being sampled."""
+
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.time()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.write(name, start, time.perf_counter() - begin)
+
+
+def await_first_audio(guild_id: int) -> None:
+    """Marks the current trace to be closed by the next track starting on the guild."""
+
+    trace = _current_trace.get()
+    if trace is not None:
+        _awaiting_audio[guild_id] = trace
+
+
+def cancel_first_audio(guild_id: int) -> None:
+    """Stops waiting for the first audio of the current trace, when its track couldn't be queued."""
+
+    trace = _current_trace.get()
+    if trace is not None and _awaiting_audio.get(guild_id) is trace:
+        del _awaiting_audio[guild_id]
+
+
+def first_audio(guild_id: int) -> None:
+    """Called on track start, records the time from the gateway event to audio playing."""
+
+    trace = _awaiting_audio.pop(guild_id, None)
+    if trace is not None:
+        now = time.time()
+        if now - trace.received_at <= FIRST_AUDIO_TIMEOUT:
+            trace.write("first_audio", trace.received_at, now - trace.received_at)
+
+
+def traced(callback):
+    """Decorator for command callbacks, samples TRACE_SAMPLE_RATE of the invocations.
+
+    Put it below `lightbulb.implements` so lightbulb gets the wrapped callback.
+    """
+
+    @functools.wraps(callback)
+    async def wrapper(ctx: lightbulb.Context) -> None:
+        if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+            return await callback(ctx)
+
+        _setup_file()
+
+        # The snowflake of the message or interaction tells when Discord created the event,
+        # so the gateway span covers the gateway and dispatch latency.
+        if isinstance(ctx, lightbulb.SlashContext):
+            received_at = ctx.interaction.id.created_at.timestamp()
+        else:
+            received_at = ctx.event.message.id.created_at.timestamp()
+
+        trace = Trace(ctx.command.name, ctx.guild_id, received_at)
+        trace.write("gateway", received_at, time.time() - received_at)
+        token = _current_trace.set(trace)
+        try:
+            with span("command"):
+                return await callback(ctx)
+        except BaseException:
+            # Whatever was queued before the error, don't let a later track start close this trace.
+            cancel_first_audio(ctx.guild_id)
+            raise
+        finally:
+            _current_trace.reset(token)
+
+    return wrapper
+
+
+def summarize(path: str, top: int) -> None:
+    """Prints the slowest spans per command in a trace file and its rotated backups."""
+
+    # The current file may not exist yet, or only rotated backups may be left.
+    file_names = [name for name in [path] + sorted(glob.glob(glob.escape(path) + ".[0-9]*")) if os.path.isfile(name)]
+    if not file_names:
+        print(f"No traces found in {path}")
+        return
+
+    durations = defaultdict(lambda: defaultdict(list))
+    for file_name in file_names:
+        with open(file_name) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    command, name, duration = record["command"], record["span"], float(record["duration_ms"])
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    continue
+                durations[command][name].append(duration)
+
+    for command, spans in sorted(durations.items()):
+        traces = len(spans.get("command", []))
+        print(f"{command} ({traces} traces)")
+        print(f"  {'span':<32} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+
+        rows = []
+        for name, values in spans.items():
+            values.sort()
+            p50 = values[len(values) // 2]
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            rows.append((p95, name, len(values), p50, values[-1]))
+
+        for p95, name, count, p50, maximum in sorted(rows, reverse = True)[:top]:
+            print(f"  {name:<32} {count:>6} {p50:>10.1f} {p95:>10.1f} {maximum:>10.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Summarize the slowest stages per command from a trace file.")
+    parser.add_argument("file", nargs = "?", default = TRACE_FILE, help = "The trace file, defaults to TRACE_FILE.")
+    parser.add_argument("--top", type = int, default = 10, help = "How many spans to show per command.")
+    args = parser.parse_args()
+
+    summarize(args.file, args.top)